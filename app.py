@@ -1,13 +1,21 @@
 # -*- coding: utf-8 -*-
+import atexit
+import signal
 import time
-import json
 import os
 import random
 import hashlib
+import io
+import tempfile
+import threading
 from functools import wraps
-from flask import Flask, request, jsonify, redirect, render_template_string, url_for, Response, current_app
+from flask import Flask, Request, g, has_request_context, request, jsonify, redirect, url_for, Response
+from flask.json.provider import JSONProvider
 from werkzeug.exceptions import RequestEntityTooLarge
+import orjson
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config as BotoConfig
 from botocore.exceptions import NoCredentialsError
 
 # ----------------------
@@ -18,15 +26,31 @@ DEFAULT_ICON_URL = "https://drive.idkwhatismyname.space/hFxt8p2mnpmLhBS1.png"
 # ----------------------
 # 环境变量及设置
 # ----------------------
+class SpooledRequest(Request):
+    """上传解析用 SpooledTemporaryFile 作为落盘工厂：32 MiB 以内的文件留在内存，
+    只有真正的大 APK 才写磁盘，小上传不再往 /tmp 写文件"""
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=32 * 1024 * 1024, mode="rb+")
+
 app = Flask(__name__)
+app.request_class = SpooledRequest
+
+# 🌟 让 jsonify 也走 orjson：剩余的 jsonify 调用 (apk 详情、report 等) 同样在 C 层序列化
+class ORJSONProvider(JSONProvider):
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+app.json = ORJSONProvider(app)
+
 DATA_FILE = "apps.json"
 CONFIG_FILE = "config.json"
 SN_FILE = "sn_access_control.json"
-TEMP_UPLOAD_FOLDER = "temp_uploads"
 
 # 🌟 设置文件上传限制为 1 GB
 app.config['MAX_CONTENT_LENGTH'] = 1 * 1024 * 1024 * 1024
-app.config['UPLOAD_FOLDER'] = TEMP_UPLOAD_FOLDER
 
 # ----------------------
 # 错误处理
@@ -36,40 +60,180 @@ def request_entity_too_large(error):
     """处理文件大小超过 Flask 配置限制 (413 Request Entity Too Large)"""
     return redirect(url_for('admin_page_get', message="错误：文件大小超过 1 GB 的限制，请上传小文件。"))
 
+# ----------------------
+# 请求体防护
+# ----------------------
+# 只有 APK 上传路由允许 multipart 大请求体；其余 POST 都是小表单，
+# 不该经过 multipart 边界扫描器、更不该往磁盘假脱机
+_UPLOAD_PATH = "/manage_app_data_zybiot_1223/upload_apk"
+_ADMIN_PREFIXES = ("/manage_app_data_zybiot_1223", "/super_admin_config_1223")
+
+@app.before_request
+def guard_request_body():
+    if request.method != "POST" or request.path == _UPLOAD_PATH:
+        return None
+
+    content_type = request.content_type or ""
+    if content_type.startswith("multipart/"):
+        return Response("此接口不接受 multipart 请求体", 413)
+
+    # 🌟 管理表单路由只接受很小的 urlencoded 请求体：保证解析永远走
+    # Werkzeug 的 urlencoded 快路径，不会碰 multipart 边界扫描器
+    if request.path.startswith(_ADMIN_PREFIXES):
+        if (request.content_length or 0) > 8 * 1024:
+            return Response("请求体过大", 413)
+        if request.content_length and not content_type.startswith("application/x-www-form-urlencoded"):
+            return Response("此接口只接受 application/x-www-form-urlencoded", 413)
+        return None
+
+    if (request.content_length or 0) > 64 * 1024:
+        return Response("请求体过大", 413)
+    return None
+
+# ----------------------
+# 请求级时间戳
+# ----------------------
+@app.before_request
+def stamp_request_time():
+    """每个请求只读一次时钟：响应组装时 logId/requestId/uploadTime 反复要毫秒时间戳，
+    原来每个应用、每个字段都调一次 int(time.time()*1000)"""
+    g.now_ms = int(time.time() * 1000)
+    g.now_ms_str = str(g.now_ms)
+
+def _now_ms():
+    """请求上下文内复用 g.now_ms，脱离请求上下文时退回直接读时钟"""
+    return g.now_ms if has_request_context() else int(time.time() * 1000)
+
 # ----------------------
 # R2 相关配置和初始化
 # ----------------------
+# 🌟 boto3 客户端构造很贵 (session、endpoint 解析、凭证链)，进程内复用同一个实例，
+# 只有 config.json 变化时才重建
+_R2_LOCK = threading.Lock()
+_R2_CLIENT = {"client": None, "bucket": None, "mtime": 0}
+
+# 🌟 大 APK 的传输参数：16 MiB 分段、8 路并发，让上传吃满网络管道而不是单流 PUT
+_R2_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=16 * 1024 * 1024,
+    max_concurrency=8,
+    use_threads=True
+)
+
+# 连接池开大到够 8 路分段并发复用，重试交给 botocore 的自适应模式
+_R2_BOTO_CONFIG = BotoConfig(
+    max_pool_connections=50,
+    retries={'max_attempts': 3, 'mode': 'adaptive'}
+)
+
 def get_r2_client():
-    """从 config.json 加载 R2 配置并初始化 boto3 客户端"""
-    config = load_config()
-    r2_config = config.get("r2_config")
+    """从 config.json 加载 R2 配置并初始化 boto3 客户端 (进程内单例)"""
+    with _R2_LOCK:
+        try:
+            mtime = os.stat(CONFIG_FILE).st_mtime_ns
+        except OSError:
+            mtime = 0
 
-    if not r2_config or r2_config.get('access_key_id') == 'YOUR_R2_ACCESS_KEY_ID':
-        print("Error: R2 configuration missing or using placeholder values.")
-        return None, None
+        if _R2_CLIENT["client"] is not None and mtime == _R2_CLIENT["mtime"]:
+            return _R2_CLIENT["client"], _R2_CLIENT["bucket"]
 
-    try:
-        s3_client = boto3.client(
-            's3',
-            endpoint_url=r2_config['endpoint_url'],
-            aws_access_key_id=r2_config['access_key_id'],
-            aws_secret_access_key=r2_config['secret_access_key']
-        )
+        config = load_config()
+        r2_config = config.get("r2_config")
+
+        if not r2_config or r2_config.get('access_key_id') == 'YOUR_R2_ACCESS_KEY_ID':
+            print("Error: R2 configuration missing or using placeholder values.")
+            return None, None
+
+        try:
+            s3_client = boto3.client(
+                's3',
+                endpoint_url=r2_config['endpoint_url'],
+                aws_access_key_id=r2_config['access_key_id'],
+                aws_secret_access_key=r2_config['secret_access_key'],
+                config=_R2_BOTO_CONFIG
+            )
+        except Exception as e:
+            print(f"Error initializing R2 client: {e}")
+            return None, None
+
+        _R2_CLIENT["client"] = s3_client
+        _R2_CLIENT["bucket"] = r2_config['bucket_name']
+        _R2_CLIENT["mtime"] = mtime
         return s3_client, r2_config['bucket_name']
-    except Exception as e:
-        print(f"Error initializing R2 client: {e}")
-        return None, None
 
 
 # ----------------------
 # 辅助函数：加载/保存配置 (Config Load/Save)
 # ----------------------
+# 🌟 mtime 缓存：每个请求都重新读盘+解析 JSON 太浪费，文件没变时直接复用上次解析结果
+_CACHE_LOCK = threading.Lock()
+_CONFIG_CACHE = {"mtime": 0, "data": None, "version": 0}
+_SN_CACHE = {"mtime": 0, "data": None}
+# version 在每次应用目录变化时 +1，给下游的派生缓存当失效键用
+_APPS_CACHE = {"mtime": 0, "data": None, "version": 0}
+
+# 🌟 单写者模式：save_* 只更新内存并标脏，后台线程周期性落盘 (见 flush_dirty_state)，
+# 连续的管理操作被合并成一次写盘
+_DIRTY = set()
+_FLUSH_INTERVAL = 0.1
+
+def _cache_fresh(cache, path):
+    """文件 mtime 未变化时返回 True，可直接使用缓存数据"""
+    try:
+        return cache["data"] is not None and os.stat(path).st_mtime_ns == cache["mtime"]
+    except OSError:
+        return False
+
+def _cache_store(cache, path, data):
+    """写入缓存并记录当前文件 mtime"""
+    try:
+        cache["mtime"] = os.stat(path).st_mtime_ns
+    except OSError:
+        cache["mtime"] = 0
+    cache["data"] = data
+
+# 🌟 生产默认写紧凑 JSON：缩进美化占序列化时间的可观比例，文件也更大；
+# 需要人工翻看文件时设置环境变量 APPSTORE_PRETTY_JSON=1
+_JSON_DUMP_OPTION = orjson.OPT_INDENT_2 if os.environ.get("APPSTORE_PRETTY_JSON") else 0
+
+def _atomic_write_json(path, obj):
+    """原子写 JSON：先整体序列化、一次性写入同目录临时文件并 fsync，再 os.replace 替换。
+
+    之前直接 open(path, "w") 会先截断文件，写一半崩溃就留下残缺 JSON；
+    整块写入也避免了小块写盘的系统调用开销。
+    """
+    fd, tmp_name = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(orjson.dumps(obj, option=_JSON_DUMP_OPTION))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_name, path)
+    except Exception:
+        if os.path.exists(tmp_name):
+            os.remove(tmp_name)
+        raise
+
 def load_config():
     """加载用户配置和全局设置"""
+    # 同一个请求内的重复调用连 stat() 都省掉，直接用 g 上的引用
+    if has_request_context():
+        cached = g.get("_req_config")
+        if cached is not None:
+            return cached
+
     if not os.path.exists(CONFIG_FILE):
+        # 文件不存在也可能只是后台线程还没写出，内存里有就直接用
+        with _CACHE_LOCK:
+            if _CONFIG_CACHE["data"] is not None:
+                config = _CONFIG_CACHE["data"]
+                if has_request_context():
+                    g._req_config = config
+                return config
         # 初始配置，包含 R2 模板、用户和公共域名
         initial_config = {
             "public_domain": "zybapk.idkwhatismyname.space",
+            "next_app_id": 100000,
             "r2_config": {
                 "endpoint_url": "https://<ACCOUNT_ID>.r2.cloudflarestorage.com",
                 "access_key_id": "YOUR_R2_ACCESS_KEY_ID",
@@ -84,57 +248,106 @@ def load_config():
         save_config(initial_config)
         return initial_config
 
-    try:
-        with open(CONFIG_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception as e:
-        print(f"Error reading {CONFIG_FILE}: {e}")
-        return {}
+    with _CACHE_LOCK:
+        if _cache_fresh(_CONFIG_CACHE, CONFIG_FILE):
+            config = _CONFIG_CACHE["data"]
+        else:
+            try:
+                with open(CONFIG_FILE, "rb") as f:
+                    config = orjson.loads(f.read())
+            except Exception as e:
+                print(f"Error reading {CONFIG_FILE}: {e}")
+                return {}
+            _cache_store(_CONFIG_CACHE, CONFIG_FILE, config)
+            _CONFIG_CACHE["version"] += 1
+    if has_request_context():
+        g._req_config = config
+    return config
 
 def save_config(config):
-    """保存用户配置和全局设置"""
-    try:
-        with open(CONFIG_FILE, "w", encoding="utf-8") as f:
-            json.dump(config, f, ensure_ascii=False, indent=2)
-        return True
-    except Exception as e:
-        print(f"Error saving {CONFIG_FILE}: {e}")
-        return False
+    """保存用户配置和全局设置 (立即生效到内存，落盘交给后台线程)"""
+    with _CACHE_LOCK:
+        _CONFIG_CACHE["data"] = config
+        _CONFIG_CACHE["version"] += 1
+        _DIRTY.add("config")
+    if has_request_context():
+        g._req_config = config
+    return True
 
 def load_sn_config():
     """加载 SN 码归属配置"""
+    if has_request_context():
+        cached = g.get("_req_sn_config")
+        if cached is not None:
+            return cached
+
     if not os.path.exists(SN_FILE):
+        with _CACHE_LOCK:
+            if _SN_CACHE["data"] is not None:
+                sn_config = _SN_CACHE["data"]
+                if has_request_context():
+                    g._req_sn_config = sn_config
+                return sn_config
         initial_sn_config = {
             "114514": "manager_user"
         }
         save_sn_config(initial_sn_config)
         return initial_sn_config
 
-    try:
-        with open(SN_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception as e:
-        print(f"Error reading {SN_FILE}: {e}")
-        return {}
+    with _CACHE_LOCK:
+        if _cache_fresh(_SN_CACHE, SN_FILE):
+            sn_config = _SN_CACHE["data"]
+        else:
+            try:
+                with open(SN_FILE, "rb") as f:
+                    sn_config = orjson.loads(f.read())
+            except Exception as e:
+                print(f"Error reading {SN_FILE}: {e}")
+                return {}
+            _cache_store(_SN_CACHE, SN_FILE, sn_config)
+    if has_request_context():
+        g._req_sn_config = sn_config
+    return sn_config
 
 def save_sn_config(sn_config):
-    """保存 SN 码归属配置"""
-    try:
-        with open(SN_FILE, "w", encoding="utf-8") as f:
-            json.dump(sn_config, f, ensure_ascii=False, indent=2)
+    """保存 SN 码归属配置 (立即生效到内存，落盘交给后台线程)"""
+    with _CACHE_LOCK:
+        _SN_CACHE["data"] = sn_config
+        _DIRTY.add("sn")
+    if has_request_context():
+        g._req_sn_config = sn_config
+    return True
+
+# ----------------------
+# 辅助函数：上传流哈希
+# ----------------------
+class HashingStream(io.RawIOBase):
+    """包装上传流，在数据流向 R2 的同时累计 MD5 和字节数。
+
+    之前的流程要对同一个 APK 过三遍磁盘（落临时文件、读回算 MD5、再读一遍上传），
+    对 1 GB 的文件来说大部分时间都耗在多余的 I/O 上；现在只过一遍。
+    """
+    def __init__(self, source):
+        self._source = source
+        self._md5 = hashlib.md5()
+        self.size = 0
+
+    def readable(self):
         return True
-    except Exception as e:
-        print(f"Error saving {SN_FILE}: {e}")
-        return False
+
+    def read(self, size=-1):
+        data = self._source.read(size)
+        if data:
+            self._md5.update(data)
+            self.size += len(data)
+        return data
+
+    def hexdigest(self):
+        return self._md5.hexdigest()
 
 # ----------------------
 # 权限认证装饰器和函数 (保持不变)
 # ----------------------
-def get_logged_in_user():
-    """从当前请求的 Header 中获取已登录的用户名"""
-    auth = request.authorization
-    return auth.username if auth else None
-
 def authenticate(realm):
     """要求用户进行身份验证"""
     return Response(
@@ -142,6 +355,10 @@ def authenticate(realm):
         'Login required.', 401,
         {'WWW-Authenticate': f'Basic realm="{realm}"'})
 
+# 🌟 表驱动认证：按配置版本缓存 (用户名, 密码) -> 用户 的查找表，
+# 配置一变 (加用户/改密码) 版本号就变，查找表自动重建
+_AUTH_TABLE = {"version": None, "table": {}}
+
 def has_role(required_role):
     def decorator(f):
         @wraps(f)
@@ -149,13 +366,16 @@ def has_role(required_role):
             auth = request.authorization
             config = load_config()
 
-            if not auth or auth.username not in config.get("users", {}):
-                return authenticate(f"Login as {required_role}")
-
-            user = config["users"][auth.username]
+            version = _CONFIG_CACHE["version"]
+            if _AUTH_TABLE["version"] != version:
+                _AUTH_TABLE["table"] = {
+                    (name, info.get("password")): info
+                    for name, info in config.get("users", {}).items()
+                }
+                _AUTH_TABLE["version"] = version
 
-            # 检查密码
-            if user["password"] != auth.password:
+            user = _AUTH_TABLE["table"].get((auth.username, auth.password)) if auth else None
+            if user is None:
                 return authenticate(f"Login as {required_role}")
 
             # 检查角色
@@ -166,6 +386,12 @@ def has_role(required_role):
             elif user_role != required_role:
                 return Response(f"Access denied. Required role: {required_role}", 403)
 
+            # 🌟 认证时已经解码过配置并查到了用户，挂到 g 上让处理函数直接复用，
+            # 不用再各自 load_config() 一遍
+            g.config = config
+            g.user = user
+            g.username = auth.username
+
             return f(*args, **kwargs)
         return decorated
     return decorator
@@ -174,9 +400,82 @@ def has_role(required_role):
 # ----------------------
 # 辅助函数：应用数据 (App Data Utilities)
 # ----------------------
+# 🌟 SN 筛选视图：load 时一次性算好"公共应用列表"和"SN -> 应用"反向索引，
+# 查询时不再遍历整个应用列表，代价只和结果数有关
+_SN_VIEW = {"public": [], "index": {}}
+
+# 🌟 id -> 应用 索引：查重、删除、详情查找都是 O(1)，不再线性扫描整个列表
+_APPS_BY_ID = {}
+
+def get_app_by_id(app_id):
+    """按 id 查找应用 (接受字符串或整数 id)"""
+    try:
+        return _APPS_BY_ID.get(int(app_id))
+    except (TypeError, ValueError):
+        return None
+
+def _normalize_apps(apps):
+    """应用列表进入内存时的规整处理。
+
+    重建 SN 筛选视图 (公共应用 + 反向索引) 和 id 索引，预计算响应路径要用的派生字段。
+    以 _ 开头的派生字段只存在于内存，save_apps 落盘时会剥掉。
+    """
+    global _SN_VIEW, _APPS_BY_ID
+
+    public_apps = []
+    sn_index = {}
+    for app_data in apps:
+        # id 只在进入内存时规整一次成 int，响应路径不再做逐次转换/随机兜底
+        try:
+            app_data["id"] = int(app_data["id"])
+        except (KeyError, TypeError, ValueError):
+            app_data["id"] = random.randint(100000, 999999)
+
+        # size 只在应用增改时变化，字节数和显示字符串都在这里算好
+        try:
+            size_bytes = int(app_data.get("size", 0) or 0)
+        except ValueError:
+            size_bytes = 0
+        app_data["_sizeBytes"] = size_bytes
+        app_data["_sizeStr"] = _format_size(size_bytes)
+
+        # 搜索用的小写字符串也在加载时算好，关键词搜索不再逐请求 .lower()
+        app_data["_nameLc"] = app_data.get("appName", "").lower()
+        app_data["_pkgLc"] = app_data.get("packageName", "").lower()
+
+        allowed = app_data.get("allowedSn")
+        if allowed is None:
+            continue
+        if not allowed:
+            public_apps.append(app_data)
+        else:
+            for sn in allowed:
+                sn_index.setdefault(sn, []).append(app_data)
+    # 列表接口的精简行和 /apk 详情载荷在加载时一次性物化，响应路径只做收集
+    for app_data in apps:
+        app_data["_searchRow"] = _build_search_row(app_data)
+        app_data["_apkPayload"] = _build_apk_payload(app_data)
+
+    # 🌟 多线程服务下派生索引不能原地 clear+重建 (读线程会看到半成品)，
+    # 整体构建好之后各自用一次赋值原子发布
+    _SN_VIEW = {"public": public_apps, "index": sn_index}
+    _APPS_BY_ID = {app_data["id"]: app_data for app_data in apps}
+    return apps
+
 def load_apps():
     """加载应用并确保基本结构存在"""
+    if has_request_context():
+        cached = g.get("_req_apps")
+        if cached is not None:
+            return cached
+
     if not os.path.exists(DATA_FILE):
+        with _CACHE_LOCK:
+            if _APPS_CACHE["data"] is not None:
+                apps = _APPS_CACHE["data"]
+                if has_request_context():
+                    g._req_apps = apps
+                return apps
         # 初始应用列表，确保有 allowedSn 字段
         initial_data = [{
             "appId": "mt-001", "id": 602750, "name": "114514", "appName": "114514",
@@ -193,101 +492,214 @@ def load_apps():
         save_apps(initial_data)
         return initial_data
 
-    try:
-        with open(DATA_FILE, "r", encoding="utf-8", errors='ignore') as f:
-            data = json.load(f)
-            if not isinstance(data, list): return []
-            return [item for item in data if isinstance(item, dict)]
-
-    except json.JSONDecodeError as e:
-        # 🌟 修复：如果 JSON 解析失败，打印错误信息，返回空列表，避免程序崩溃。
-        print(f"Error reading {DATA_FILE}: JSON Decode Error: {e}. Returning empty list.")
-        return []
+    with _CACHE_LOCK:
+        if _cache_fresh(_APPS_CACHE, DATA_FILE):
+            apps = _APPS_CACHE["data"]
+        else:
+            try:
+                with open(DATA_FILE, "rb") as f:
+                    data = orjson.loads(f.read())
+                    if not isinstance(data, list): data = []
+                    apps = [item for item in data if isinstance(item, dict)]
+
+            except orjson.JSONDecodeError as e:
+                # 🌟 修复：如果 JSON 解析失败，打印错误信息，返回空列表，避免程序崩溃。
+                print(f"Error reading {DATA_FILE}: JSON Decode Error: {e}. Returning empty list.")
+                return []
+            _MAPPED_CACHE.clear()
+            _cache_store(_APPS_CACHE, DATA_FILE, _normalize_apps(apps))
+            _APPS_CACHE["version"] += 1
+    if has_request_context():
+        g._req_apps = apps
+    return apps
 
 def save_apps(apps):
-    """将应用列表保存到 JSON 文件"""
-    with open(DATA_FILE, "w", encoding="utf-8") as f:
-        json.dump(apps, f, ensure_ascii=False, indent=2)
+    """更新内存中的应用列表并标记待落盘 (_ 开头的派生字段在落盘时剥离)"""
+    with _CACHE_LOCK:
+        _MAPPED_CACHE.clear()
+        _APPS_CACHE["data"] = _normalize_apps(apps)
+        _APPS_CACHE["version"] += 1
+        _DIRTY.add("apps")
+    if has_request_context():
+        g._req_apps = apps
+
+class PersistenceTxn:
+    """把一次管理操作涉及的多个文件修改合并成一个提交阶段。
+
+    用法：handler 在 with 块里改内存数据并把要落盘的对象挂到 txn 上，
+    退出时统一提交到内存缓存并标脏，由后台落盘线程一次性写出；
+    块内抛异常则什么都不提交。
+    """
+    def __init__(self):
+        self.apps = None
+        self.config = None
+        self.sn_config = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            return False
+        if self.apps is not None:
+            save_apps(self.apps)
+        if self.config is not None:
+            save_config(self.config)
+        if self.sn_config is not None:
+            save_sn_config(self.sn_config)
+        return False
+
+# ----------------------
+# 后台落盘线程 (单写者)
+# ----------------------
+_FLUSH_TARGETS = {
+    "config": (CONFIG_FILE, _CONFIG_CACHE),
+    "sn": (SN_FILE, _SN_CACHE),
+    "apps": (DATA_FILE, _APPS_CACHE),
+}
+
+def flush_dirty_state():
+    """把标脏的内存数据写盘：后台线程周期调用，进程退出时再同步调用一次。
+
+    写盘只发生在这一个地方，路由里的连续修改会被自动合并成一次写；
+    代价是硬崩溃最多丢最近 _FLUSH_INTERVAL 秒内的管理操作，对本工具可接受。
+    退出兜底分两层：atexit 覆盖 gunicorn 的优雅退出，直接 python app.py 跑
+    内置服务器时 SIGTERM (docker stop / systemd) 不会触发 atexit，
+    由 __main__ 里装的信号处理器先落盘再退出。
+    """
+    with _CACHE_LOCK:
+        pending = []
+        for name in _DIRTY:
+            path, cache = _FLUSH_TARGETS[name]
+            pending.append((name, path, cache, cache["data"]))
+        _DIRTY.clear()
+    wrote = False
+    for name, path, cache, data in pending:
+        if data is None:
+            continue
+        if name == "apps":
+            data = [{k: v for k, v in app_data.items() if not k.startswith("_")} for app_data in data]
+        try:
+            _atomic_write_json(path, data)
+        except Exception as e:
+            print(f"Error saving {path}: {e}")
+            with _CACHE_LOCK:
+                _DIRTY.add(name)  # 下个周期重试
+            continue
+        wrote = True
+        with _CACHE_LOCK:
+            try:
+                cache["mtime"] = os.stat(path).st_mtime_ns
+            except OSError:
+                cache["mtime"] = 0
+    if wrote:
+        # 对目录 fsync 一次，保证本轮所有 rename 都持久化
+        dir_fd = os.open(".", os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+def _flusher_loop():
+    while True:
+        time.sleep(_FLUSH_INTERVAL)
+        flush_dirty_state()
+
+threading.Thread(target=_flusher_loop, name="state-flusher", daemon=True).start()
+atexit.register(flush_dirty_state)
 
 def filter_apps_by_sn(all_apps, client_sn):
     """
     根据客户端 SN 码筛选允许的应用列表，并处理公共应用逻辑。
     V25 强化逻辑：只有明确设置 allowedSn=[] 的应用才是公共应用。
+
+    实现：直接查 _normalize_apps 构建好的公共应用列表和 SN 反向索引，
+    不再逐个应用扫描 (代价从 O(应用总数) 降到 O(结果数))。
     """
     client_sn = client_sn.strip()
+    view = _SN_VIEW  # 取一次引用，公共列表和索引保证来自同一个版本
 
-    # 如果客户端提供了 SN 码
+    # 如果客户端提供了 SN 码：公共应用 + 该 SN 的白名单应用
     if client_sn:
-        filtered_list = []
-        for app in all_apps:
-            allowed_sns = app.get("allowedSn")
-
-            # 条件：
-            # A. allowed_sns 明确为空 [] -> 视为公共应用，可见
-            # B. client_sn 存在于 allowed_sns 列表中 -> 视为白名单应用，可见
-            if allowed_sns is not None and len(allowed_sns) == 0:
-                # 明确的公共应用
-                filtered_list.append(app)
-            elif allowed_sns and client_sn in allowed_sns:
-                # 明确的白名单应用
-                filtered_list.append(app)
-
-        return filtered_list
-
-    # 1. 如果客户端未提供 SN 码 (client_sn 为空)
-    else:
-        # 仅返回 allowedSn 字段明确为空列表 [] 的应用 (即：公共应用)
-        return [app for app in all_apps if app.get("allowedSn") is not None and len(app.get("allowedSn")) == 0]
+        return view["public"] + view["index"].get(client_sn, [])
+
+    # 如果客户端未提供 SN 码：仅返回 allowedSn 明确为空列表 [] 的公共应用
+    return list(view["public"])
 
 
 # ----------------------
 # 字段映射和 API 适配器 (保持不变)
 # ----------------------
+def _format_size(size_bytes):
+    """把字节数格式化成客户端显示用的大小字符串 (在 _normalize_apps 里按应用算一次)
+
+    先用整数比较分桶，只有选中的分支才做一次除法。
+    """
+    if size_bytes >= 1024 * 1024:
+        return f"{size_bytes / (1024 * 1024):.1f}M"
+    if size_bytes < 1024:
+        return f"{size_bytes}B"
+    return f"{size_bytes / 1024:.1f}KB"
+
 DEFAULT_PERMISSIONS = [
     {"name": "互联网", "desc": "允许应用打开网络套接字。", "descEng": "Allows applications to open network sockets."},
     {"name": "读取电话状态", "desc": "允许只读访问电话状态...", "descEng": "Allows read only access to phone state..."}
 ]
 
-def generate_search_list(app_list):
-    search_keywords = ["", "", "期末最强提分秘籍", ""]
-    for app_data in app_list:
-        search_keywords.append(app_data.get("appName", ""))
-    search_keywords.extend([""] * 20)
-    return search_keywords
+# 🌟 映射结果缓存：同一个应用版本 (id, updateTime) 的映射结果完全一致，
+# 没必要每个 API 请求都重建一遍 40 多个键的 dict；apps.json 重新解析时整体清空
+_MAPPED_CACHE = {}
 
 def map_app_fields(app_data):
     """将内部应用结构映射到客户端 App 期望的复杂字段集 (App Detailed Format)"""
 
-    try:
-        size_bytes = int(app_data.get("size", 0) or 0)
-    except ValueError:
-        size_bytes = 0
+    cache_key = (app_data.get("id"), app_data.get("updateTime"))
+    cached = _MAPPED_CACHE.get(cache_key)
+    if cached is not None:
+        return cached
+
+    # 🌟 绑定一次方法引用，省掉未命中路径上约 20 次属性查找
+    get = app_data.get
 
-    size_mb = size_bytes / (1024 * 1024)
-    default_preview_pic = app_data.get("iconUrl", DEFAULT_ICON_URL)
+    # size 字节数和显示字符串已在 _normalize_apps 里预计算
+    size_bytes = get("_sizeBytes")
+    if size_bytes is None:
+        try:
+            size_bytes = int(get("size", 0) or 0)
+        except ValueError:
+            size_bytes = 0
+    size_str = get("_sizeStr") or _format_size(size_bytes)
+
+    default_preview_pic = get("iconUrl", DEFAULT_ICON_URL)
 
     # 修复：确保 packageName 始终存在
-    app_package_name = app_data.get("packageName")
+    app_package_name = get("packageName")
     if not app_package_name:
-        base_name = app_data.get("appName", app_data.get("name", "unknown_app")).lower().replace(" ", "_")
+        base_name = get("appName", get("name", "unknown_app")).lower().replace(" ", "_")
         app_package_name = f"com.default.{base_name}"
 
+    # 🌟 Python 参数急切求值：原来写成 get("id", random.randint(...))，即使 id 存在
+    # 也会白抽一次随机数；id 已在 _normalize_apps 里规整成 int
+    app_id = get("id")
+    if app_id is None:
+        app_id = random.randint(100000, 999999)
+
     mapped_app = {
-        "id": int(app_data.get("id", random.randint(100000, 999999))),
-        "name": app_data.get("appName", app_data.get("name", "未命名应用")),
-        "enName": app_data.get("enName", ""),
-        "summary": app_data.get("desc", ""),
-        "icon": app_data.get("iconUrl", DEFAULT_ICON_URL),
-        "apkUrl": app_data.get("downloadUrl", ""),
+        "id": app_id,
+        "name": get("appName", get("name", "未命名应用")),
+        "enName": get("enName", ""),
+        "summary": get("desc", ""),
+        "icon": get("iconUrl", DEFAULT_ICON_URL),
+        "apkUrl": get("downloadUrl", ""),
         "apkName": app_package_name,
         "apkSize": size_bytes,
-        "apkSizeStr": f"{size_mb:.1f}M" if size_mb >= 1 else (f"{size_bytes}B" if size_bytes < 1024 else f"{size_bytes/1024:.1f}KB"),
-        "apkVersion": app_data.get("versionName", app_data.get("version", "1.0")),
-        "apkMd5": app_data.get("md5", ""),
-        "remark": app_data.get("desc", ""),
-        "changeLog": app_data.get("changelog", ""),
-        "developer": app_data.get("publisher", ""),
-        "uploadTime": int(app_data.get("updateTime", int(time.time() * 1000))),
+        "apkSizeStr": size_str,
+        "apkVersion": get("versionName", get("version", "1.0")),
+        "apkMd5": get("md5", ""),
+        "remark": get("desc", ""),
+        "changeLog": get("changelog", ""),
+        "developer": get("publisher", ""),
+        "uploadTime": int(get("updateTime") or _now_ms()),
         "previewPics": [default_preview_pic] * 5,
         "isSensitive": 0, "statusInPad": 0, "onShelf": 1, "entertainment": 1, "entertainmentLabel": "轻度娱乐",
         "advertisement": 0, "advertisementLabel": "", "browseWeb": 0, "supervise": 0, "risk": 0,
@@ -295,57 +707,84 @@ def map_app_fields(app_data):
         "age": 8, "ageLabel": "8岁+", "containPayContent": 1, "payContentLabel": "含三方付费项目",
         "icpNumber": "京ICP备xxxxxx号", "privacyLink": "#",
         "permissions": DEFAULT_PERMISSIONS,
-        "tags": app_data.get("tags", [{"name":"通用","bgColor":"#FFF2D0","textColor":"#C1A161"}]),
+        "tags": get("tags", [{"name":"通用","bgColor":"#FFF2D0","textColor":"#C1A161"}]),
         "from": 0, "remoteInstallMsg": "", "appIdThird": 0, "versionCodeThird": 0, "extraThird": "",
         "ctl": 0, "bizPicture": ""
     }
 
+    if cache_key[0] is not None:
+        _MAPPED_CACHE[cache_key] = mapped_app
     return mapped_app
 
-def api_response_search(data_list):
-    """适配 /apps, /recommend/appList 等接口 (errNo/data: list)"""
-    simplified_data = []
-
-    if data_list:
-        for app_data in data_list:
-            mapped = map_app_fields(app_data)
-            simplified_data.append({
-                "apkName": mapped["apkName"], "ctl": mapped["ctl"], "isCtlWhite": mapped["isCtlWhite"],
-                "isGreenApp": mapped["isGreenApp"], "supervise": mapped["supervise"], "risk": mapped["risk"],
-                "icon": mapped["icon"], "id": mapped["id"], "name": mapped["name"], "source": 2,
-                "size": mapped["apkSize"], "sizeStr": mapped["apkSizeStr"], "summary": mapped["summary"],
-                "version": mapped["apkVersion"], "type": 2, "installNum": 114514, "enName": mapped["enName"],
-                "isEqualKeyword": 0, "publishTime": mapped["uploadTime"], "appIdThird": mapped["appIdThird"],
-                "versionCodeThird": mapped["versionCodeThird"], "extraThird": mapped["extraThird"],
-                "downloadUrl": mapped["apkUrl"]
-            })
-
-    return jsonify({
-        "errNo": 0, "errMsg": "succ", "cost": 0.01,
-        "logId": f"{int(time.time() * 1000)}", "requestId": f"{int(time.time() * 1000)}",
-        "data": simplified_data
-    })
+def _build_search_row(app_data):
+    """构建列表接口的精简条目 (在 _normalize_apps 里按应用物化一次)"""
+    mapped = map_app_fields(app_data)
+    return {
+        "apkName": mapped["apkName"], "ctl": mapped["ctl"], "isCtlWhite": mapped["isCtlWhite"],
+        "isGreenApp": mapped["isGreenApp"], "supervise": mapped["supervise"], "risk": mapped["risk"],
+        "icon": mapped["icon"], "id": mapped["id"], "name": mapped["name"], "source": 2,
+        "size": mapped["apkSize"], "sizeStr": mapped["apkSizeStr"], "summary": mapped["summary"],
+        "version": mapped["apkVersion"], "type": 2, "installNum": 114514, "enName": mapped["enName"],
+        "isEqualKeyword": 0, "publishTime": mapped["uploadTime"], "appIdThird": mapped["appIdThird"],
+        "versionCodeThird": mapped["versionCodeThird"], "extraThird": mapped["extraThird"],
+        "downloadUrl": mapped["apkUrl"]
+    }
 
-def api_response_biz_list(app_list, biz_position):
-    """适配 /biz/list 接口 (data: {list: [ { bizName: '...', apps: [...] } ], searchList: [...]})"""
+def _build_apk_payload(app_data):
+    """构建 /apk 详情接口的下载载荷 (在 _normalize_apps 里按应用物化一次)"""
+    mapped = map_app_fields(app_data)
+    return {"id": mapped["id"], "apkName": mapped["apkName"], "version": mapped["apkVersion"],
+            "url": mapped["apkUrl"], "size": mapped["apkSize"], "md5": mapped["apkMd5"], "patchInfo": None}
 
-    converted_apps = [map_app_fields(app) for app in app_list]
+def api_response_search(data_list):
+    """适配 /apps, /recommend/appList 等接口 (errNo/data: list)
 
-    biz_list = [
-        {
-            "bizPosition": biz_position, "bizDisplayType": 1, "bizName": "首页推荐", "bizId": 32,
-            "order": 1, "apps": converted_apps
-        }
-    ]
-
-    return jsonify({
-        "errNo": 0, "errMsg": "succ", "cost": 38.65,
-        "logId": f"{int(time.time() * 1000)}", "requestId": f"{int(time.time() * 1000)}",
-        "data": {
-            "list": biz_list,
-            "searchList": generate_search_list(app_list)
-        }
-    })
+    🌟 每个条目 20+ 个键的 dict 在应用加载时就构建好了 (_searchRow)，
+    这里只做收集，不再逐请求重建
+    """
+    simplified_data = [app_data["_searchRow"] for app_data in data_list] if data_list else []
+
+    # 🌟 绕过 jsonify，直接用 orjson 序列化成 bytes 返回
+    return Response(orjson.dumps({
+        "errNo": 0, "errMsg": "succ", "cost": 0.01,
+        "logId": g.now_ms_str, "requestId": g.now_ms_str,
+        "data": simplified_data
+    }), mimetype="application/json")
+
+# 🌟 列表响应字节缓存：同一目录版本下相同参数的响应字节完全一致，序列化一次后整包复用；
+# 配合 ETag，客户端重复拉取直接 304 不传响应体。目录版本变化后旧键不再命中，
+# 条目数到上限就整批丢弃，不引入 LRU 依赖
+_RESPONSE_CACHE = {}
+_RESPONSE_CACHE_MAX = 128
+
+def _serialized_list_response(cache_key, build_results):
+    """返回列表接口的缓存响应：cache_key 标识参数，build_results(all_apps) 产出应用列表"""
+    all_apps = load_apps()  # 先保证缓存和索引与磁盘同步，再取版本号
+    version = _APPS_CACHE["version"]
+    key = (version,) + cache_key
+
+    cached = _RESPONSE_CACHE.get(key)
+    if cached is None:
+        data_list = build_results(all_apps)
+        rows = [app_data["_searchRow"] for app_data in data_list] if data_list else []
+        # 🌟 ETag 从应用数据本身派生：进程内版本号重启后会从头数，
+        # 按内容算才不会让旧客户端的 If-None-Match 撞出错误的 304
+        etag = hashlib.md5(orjson.dumps(rows)).hexdigest()[:16]
+        body = orjson.dumps({
+            "errNo": 0, "errMsg": "succ", "cost": 0.01,
+            "logId": g.now_ms_str, "requestId": g.now_ms_str,
+            "data": rows
+        })
+        cached = (body, etag)
+        if len(_RESPONSE_CACHE) >= _RESPONSE_CACHE_MAX:
+            _RESPONSE_CACHE.clear()
+        _RESPONSE_CACHE[key] = cached
+
+    body, etag = cached
+    resp = Response(body, mimetype="application/json")
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp.make_conditional(request)
 
 # ----------------------
 # HTML 模板 - App 管理后台 (移除 SN 提示)
@@ -478,7 +917,7 @@ ADMIN_HTML = """
                     <tr>
                         <td>{{ app.id }}</td>
                         <td>{{ app.appName }}</td>
-                        <td>{{ app.md5[:10] }}...</td>
+                        <td>{{ app.md5 }}...</td>
                         <td>{{ app.owner }}</td>
                         <td>
                             {% if app.allowedSn and app.allowedSn|length > 0 and app.allowedSn|first != '(权限不足，SN列表隐藏)' %}
@@ -663,12 +1102,18 @@ SUPER_ADMIN_HTML = """
 </html>
 """
 
+# 🌟 模板编译一次复用：render_template_string 每次请求都要重新 lex/parse/编译整份模板源码，
+# 这里在进程启动时用 app.jinja_env 编译好 (保留 url_for 等 Flask 全局函数)
+_INDEX_TMPL = app.jinja_env.from_string(INDEX_HTML)
+_ADMIN_TMPL = app.jinja_env.from_string(ADMIN_HTML)
+_SUPER_ADMIN_TMPL = app.jinja_env.from_string(SUPER_ADMIN_HTML)
+
 # ----------------------
 # 路由定义 (App Management Routes - Manager Role)
 # ----------------------
 
 @app.route("/")
-def index(): return render_template_string(INDEX_HTML)
+def index(): return _INDEX_TMPL.render()
 
 # 路由：管理面板 - GET (Manager 权限)
 @app.route("/manage_app_data_zybiot_1223", methods=["GET"])
@@ -677,33 +1122,32 @@ def admin_page_get():
     message = request.args.get('message')
     apps_list = load_apps()
 
-    logged_in_user = get_logged_in_user()
-    config = load_config()
-    user_role = config["users"].get(logged_in_user, {}).get("role")
+    logged_in_user = g.username
+    is_super = (g.user.get("role") == "super")
 
+    # 🌟 只构建模板真正用到的字段，避免每行做一次 30+ 键的完整 dict 拷贝
     display_list = []
-    for app in apps_list:
-        app_owner = app.get('owner', '未知')
-        can_see_sn = (user_role == "super" or app_owner == logged_in_user)
-
-        display_app = app.copy()
-        display_app['id'] = str(app.get('id'))
-        display_app['owner'] = app_owner
-
-        # 优化管理后台显示：如果是空列表，显示 (无限制/公共)
-        display_app['allowedSn'] = app.get('allowedSn', [])
-        if display_app['allowedSn'] is None or len(display_app['allowedSn']) == 0:
-             display_app['allowedSn'] = ["(无限制/公共)"]
-
-        if not can_see_sn:
-            display_app['allowedSn'] = ["(权限不足，SN列表隐藏)"]
-
-        display_list.append(display_app)
+    for app_data in apps_list:
+        app_owner = app_data.get('owner', '未知')
+
+        if is_super or app_owner == logged_in_user:
+            # 优化管理后台显示：如果是空列表，显示 (无限制/公共)
+            allowed_sn = app_data.get('allowedSn') or ["(无限制/公共)"]
+        else:
+            allowed_sn = ["(权限不足，SN列表隐藏)"]
+
+        display_list.append({
+            'id': str(app_data.get('id')),
+            'appName': app_data.get('appName', ''),
+            'md5': app_data.get('md5', '')[:10],
+            'owner': app_owner,
+            'allowedSn': allowed_sn,
+        })
 
     uploaded_info = request.args.to_dict()
 
     # 将 DEFAULT_ICON_URL 传递给模板
-    return render_template_string(ADMIN_HTML, apps_list=display_list, message=message, uploaded_info=uploaded_info, DEFAULT_ICON_URL=DEFAULT_ICON_URL)
+    return _ADMIN_TMPL.render(apps_list=display_list, message=message, uploaded_info=uploaded_info, DEFAULT_ICON_URL=DEFAULT_ICON_URL)
 
 
 # 🌟 路由：APK 文件上传 (到 R2)
@@ -723,38 +1167,22 @@ def upload_apk():
     if not s3_client:
          return redirect(url_for('admin_page_get', message="错误：R2 配置失败，请检查 config.json。"))
 
-    # 1. 临时保存文件以计算 MD5 和大小
     filename = file.filename
-    temp_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-
-    try:
-        file.save(temp_path)
-    except Exception as e:
-        return redirect(url_for('admin_page_get', message=f"错误：本地保存文件失败: {e}"))
 
-    file_size = os.path.getsize(temp_path)
+    # 1. 直接把上传流推给 R2，边传边算 MD5 和大小，不再落本地临时文件
+    hashing_stream = HashingStream(file.stream)
 
-    # 2. 自动计算 MD5
-    hash_md5 = hashlib.md5()
-    with open(temp_path, "rb") as f:
-        # 使用更安全的内存高效方式计算大文件的 MD5
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_md5.update(chunk)
-    file_md5 = hash_md5.hexdigest()
-
-    # 3. 上传到 R2
     try:
-        s3_client.upload_file(temp_path, bucket_name, filename, ExtraArgs={'ContentType': 'application/vnd.android.package-archive'})
+        s3_client.upload_fileobj(hashing_stream, bucket_name, filename, Config=_R2_TRANSFER_CONFIG, ExtraArgs={'ContentType': 'application/vnd.android.package-archive'})
 
-        # 4. 删除本地临时文件
-        os.remove(temp_path)
+        file_size = hashing_stream.size
+        file_md5 = hashing_stream.hexdigest()
 
-        # 5. 生成下载 URL
-        config = load_config()
-        public_domain = config.get('public_domain', 'default-download-domain.com')
+        # 2. 生成下载 URL
+        public_domain = g.config.get('public_domain', 'default-download-domain.com')
         download_url = f"https://{public_domain}/{filename}"
 
-        # 6. 重定向到添加应用表单，并传递信息
+        # 3. 重定向到添加应用表单，并传递信息
         return redirect(url_for(
             'admin_page_get',
             message=f"文件 {filename} 上传 R2 成功。",
@@ -766,10 +1194,8 @@ def upload_apk():
         ))
 
     except NoCredentialsError:
-        if os.path.exists(temp_path): os.remove(temp_path)
         return redirect(url_for('admin_page_get', message="错误：R2 凭证缺失或无效。"))
     except Exception as e:
-        if os.path.exists(temp_path): os.remove(temp_path)
         return redirect(url_for('admin_page_get', message=f"错误：上传 R2 失败: {e}"))
 
 
@@ -777,11 +1203,11 @@ def upload_apk():
 @app.route("/manage_app_data_zybiot_1223/add", methods=["POST"])
 @has_role("manager")
 def add_app():
-    owner_user = get_logged_in_user()
-    config = load_config()
+    owner_user = g.username
+    config = g.config
     sn_config = load_sn_config()
     all_apps = load_apps()
-    user_data = config["users"].get(owner_user, {})
+    user_data = g.user
     data = request.form
 
     # 核心字段现在通过隐藏字段传递
@@ -820,8 +1246,18 @@ def add_app():
     app_id_raw = data.get("id").strip()
     if app_id_raw and app_id_raw.isdigit():
         new_id = int(app_id_raw)
+        # 用户显式指定 ID：查重走 id 索引，O(1)
+        if new_id in _APPS_BY_ID:
+            return redirect(url_for('admin_page_get', message=f"错误：应用 ID {new_id} 已存在！请换一个 ID。"))
+        config_dirty = False
     else:
-        new_id = random.randint(100000, 999999)
+        # 🌟 自动分配走 config 里的单调计数器，不再随机撞号重试；
+        # 计数器在副本上推进，后面任何一步失败都不污染共享配置
+        new_id = config.get("next_app_id", 100000)
+        while new_id in _APPS_BY_ID:  # 跳过历史上随机分配占掉的号
+            new_id += 1
+        config = {**config, "next_app_id": new_id + 1}
+        config_dirty = True
 
     app_data = {
         "appId": data.get("packageName", "") + "-" + str(new_id),
@@ -836,22 +1272,23 @@ def add_app():
         "owner": owner_user,
         "allowedSn": app_data_allowed_sn,
 
-        "versionName": "1.0", "versionCode": "1000", "updateTime": str(int(time.time() * 1000)),
+        "versionName": "1.0", "versionCode": "1000", "updateTime": str(_now_ms()),
         "status": 1, "category": "教育", "publisher": "由idkwhatismyname创建",
         "tags": [{"name":"通用","bgColor":"#FFF2D0","textColor":"#C1A161"}], "version": "1.0", "score": 5.0, "changelog": "首次添加。", "enName": "",
     }
 
-    if any(app.get("id") == app_data["id"] for app in all_apps):
-        if not app_id_raw: app_data["id"] = random.randint(100000, 999999)
-        else: return redirect(url_for('admin_page_get', message=f"错误：应用 ID {app_data['id']} 已存在！请换一个 ID。"))
+    with PersistenceTxn() as txn:
+        # 🌟 在副本上追加：共享的缓存列表要等 save_apps normalize 完才整体替换，
+        # 并发读线程不会看到缺派生字段的半成品；txn 中途抛异常也不会留下痕迹
+        txn.apps = all_apps + [app_data]
 
-    all_apps.append(app_data)
-    save_apps(all_apps)
-
-    # 5. 更新管理员的应用计数
-    if user_data.get("role") == "manager":
-        config["users"][owner_user]["owns_apps"] = current_owns + 1
-        save_config(config)
+        # 5. 更新管理员的应用计数 (同样在副本上改，txn 提交时整体发布)
+        if user_data.get("role") == "manager":
+            users = {**config["users"], owner_user: {**user_data, "owns_apps": current_owns + 1}}
+            config = {**config, "users": users}
+            config_dirty = True
+        if config_dirty:
+            txn.config = config
 
     return redirect(url_for('admin_page_get', message=f"应用 '{app_data['appName']}' 添加成功！ID: {app_data['id']}"))
 
@@ -860,34 +1297,35 @@ def add_app():
 @app.route("/manage_app_data_zybiot_1223/delete", methods=["POST"])
 @has_role("manager")
 def delete_app():
-    owner_user = get_logged_in_user()
+    owner_user = g.username
     app_id_to_delete = request.form.get("app_id_to_delete")
     if not app_id_to_delete:
         return redirect(url_for('admin_page_get', message="错误：未提供应用 ID"))
 
     all_apps = load_apps()
-    original_count = len(all_apps)
 
-    app_to_delete = next((app for app in all_apps if str(app.get("id")) == app_id_to_delete), None)
+    # 按 id 索引直接定位，不再对整个列表做两次线性扫描
+    app_to_delete = get_app_by_id(app_id_to_delete)
 
     # 检查权限：只有应用的拥有者或 Super Admin 才能删除
-    user_role = load_config()["users"].get(owner_user, {}).get("role")
+    user_role = g.user.get("role")
 
     if app_to_delete and app_to_delete.get('owner') != owner_user and user_role != "super":
         return redirect(url_for('admin_page_get', message="错误：您无权删除此应用。"))
 
-    new_apps_list = [app for app in all_apps if str(app.get("id")) != app_id_to_delete]
+    if app_to_delete is not None:
+        with PersistenceTxn() as txn:
+            # 同 add_app：在副本上删，提交时整体替换共享列表
+            txn.apps = [app_data for app_data in all_apps if app_data is not app_to_delete]
+            msg = f"应用 ID {app_id_to_delete} 删除成功。"
 
-    if len(new_apps_list) < original_count:
-        save_apps(new_apps_list)
-        msg = f"应用 ID {app_id_to_delete} 删除成功。"
-
-        # 减少管理员的应用计数
-        app_owner = app_to_delete.get('owner')
-        config = load_config()
-        if app_owner in config["users"] and config["users"][app_owner].get("role") == "manager":
-            config["users"][app_owner]["owns_apps"] = max(0, config["users"][app_owner].get("owns_apps", 1) - 1)
-            save_config(config)
+            # 减少管理员的应用计数 (在副本上改，txn 提交时整体发布)
+            app_owner = app_to_delete.get('owner')
+            config = g.config
+            owner_info = config["users"].get(app_owner)
+            if owner_info and owner_info.get("role") == "manager":
+                new_owner = {**owner_info, "owns_apps": max(0, owner_info.get("owns_apps", 1) - 1)}
+                txn.config = {**config, "users": {**config["users"], app_owner: new_owner}}
 
     else:
         msg = f"应用 ID {app_id_to_delete} 未找到，删除失败。"
@@ -899,23 +1337,25 @@ def delete_app():
 @app.route("/super_admin_config_1223", methods=["GET"])
 @has_role("super")
 def super_admin_page():
-    config = load_config()
+    config = g.config
     sn_config = load_sn_config()
     message = request.args.get('message')
-    return render_template_string(SUPER_ADMIN_HTML, config=config, sn_config=sn_config, message=message)
+    return _SUPER_ADMIN_TMPL.render(config=config, sn_config=sn_config, message=message)
 
 # 路由：超级管理员后台 - 更新用户配置 (Super 权限)
 @app.route("/super_admin_config_1223/update_user/<username>", methods=["POST"])
 @has_role("super")
 def update_user_config(username):
-    config = load_config()
+    config = g.config
     new_password = request.form.get("new_password")
     new_max_apps = request.form.get("new_max_apps")
 
     if username not in config["users"] or config["users"][username].get("role") != "manager":
         return redirect(url_for('super_admin_page', message="错误：用户不存在或无 manager 权限。"))
 
-    user = config["users"][username]
+    # 🌟 在副本上修改：缓存让 load_config 返回的是共享字典，
+    # 校验失败提前 return 时绝不能在共享配置里留下改到一半的字段
+    user = dict(config["users"][username])
 
     # 更新密码
     if new_password:
@@ -931,14 +1371,14 @@ def update_user_config(username):
     except ValueError:
         return redirect(url_for('super_admin_page', message="错误：最大应用数必须是有效数字。"))
 
-    save_config(config)
+    save_config({**config, "users": {**config["users"], username: user}})
     return redirect(url_for('super_admin_page', message=f"用户 {username} 的配置已成功更新。"))
 
 # 路由：超级管理员后台 - 添加新用户 (Super 权限)
 @app.route("/super_admin_config_1223/add_manager", methods=["POST"])
 @has_role("super")
 def add_new_manager():
-    config = load_config()
+    config = g.config
     new_username = request.form.get("new_username")
     new_password = request.form.get("new_password")
     new_max_apps = request.form.get("new_max_apps", 114514)
@@ -955,14 +1395,14 @@ def add_new_manager():
     except ValueError:
         return redirect(url_for('super_admin_page', message="错误：最大应用数必须是有效数字。"))
 
-    config["users"][new_username] = {
+    # 同 update_user_config：在副本上加用户，通过 save_config 整体发布
+    new_user = {
         "password": new_password,
         "role": "manager",
         "max_apps": max_apps,
         "owns_apps": 0
     }
-
-    save_config(config)
+    save_config({**config, "users": {**config["users"], new_username: new_user}})
     return redirect(url_for('super_admin_page', message=f"用户 {new_username} (Manager) 添加成功，最大应用数限制为 {max_apps}。"))
 
 # 路由：超级管理员后台 - SN 码所有者分配 (V12 核心新增)
@@ -972,7 +1412,7 @@ def add_sn_owner():
     sn_code = request.form.get("sn_code").strip()
     sn_owner = request.form.get("sn_owner").strip()
     sn_config = load_sn_config()
-    config = load_config()
+    config = g.config
 
     if not sn_code or not sn_owner:
         return redirect(url_for('super_admin_page', message="错误：SN 码和所有者不能为空。"))
@@ -980,8 +1420,7 @@ def add_sn_owner():
     if sn_owner not in config["users"] or config["users"][sn_owner].get("role") != "manager":
         return redirect(url_for('super_admin_page', message=f"错误：用户 {sn_owner} 不是有效的 Manager。"))
 
-    sn_config[sn_code] = sn_owner
-    save_sn_config(sn_config)
+    save_sn_config({**sn_config, sn_code: sn_owner})
 
     return redirect(url_for('super_admin_page', message=f"SN 码 {sn_code} 已成功分配给 {sn_owner}。"))
 
@@ -993,8 +1432,7 @@ def delete_sn_owner():
     sn_config = load_sn_config()
 
     if sn_code_to_delete in sn_config:
-        del sn_config[sn_code_to_delete]
-        save_sn_config(sn_config)
+        save_sn_config({sn: owner for sn, owner in sn_config.items() if sn != sn_code_to_delete})
         return redirect(url_for('super_admin_page', message=f"SN 码 {sn_code_to_delete} 的归属绑定已成功解除。"))
     else:
         return redirect(url_for('super_admin_page', message=f"错误：SN 码 {sn_code_to_delete} 未找到或未绑定所有者。"))
@@ -1004,24 +1442,23 @@ def delete_sn_owner():
 @app.route("/iot-study/appStore/apps", methods=["GET"])
 def list_and_search_apps():
     client_sn = request.args.get("sn", "").strip()
-    all_apps = load_apps()
-    filtered_apps = filter_apps_by_sn(all_apps, client_sn)
     keyword = request.args.get("keyword", "").strip()
-    if not keyword: results = filtered_apps
-    else:
+
+    def build_results(all_apps):
+        filtered_apps = filter_apps_by_sn(all_apps, client_sn)
+        if not keyword:
+            return filtered_apps
         search_lower = keyword.lower()
-        results = [app_data for app_data in filtered_apps if search_lower in app_data.get("appName", "").lower() or search_lower in app_data.get("packageName", "").lower()]
-    return api_response_search(results)
+        return [app_data for app_data in filtered_apps if search_lower in app_data["_nameLc"] or search_lower in app_data["_pkgLc"]]
 
-# 🌟 V28 核心修改：强制重定向 biz/list 到 apps (处理客户端硬编码/缓存)
+    return _serialized_list_response(("apps", client_sn, keyword), build_results)
+
+# 🌟 biz/list 是老客户端硬编码的旧接口，直接在进程内转调 /apps 的 handler
+# 返回同样的响应体，省掉原来 302 重定向逼客户端多跑的一整个来回
 @app.route("/iot-study/appStore/biz/list", methods=["GET", "POST"])
 def biz_list_apps():
-    # 🌟 将所有 URL 参数收集起来
-    args = request.args.to_dict()
-    # 🌟 构建新的 URL，重定向到 /apps 接口，并携带所有原始参数
-    redirect_url = url_for('list_and_search_apps', **args)
-    # 🌟 返回 302 重定向，强制客户端 App 使用 /apps 接口
-    return redirect(redirect_url, code=302)
+    # sn/keyword 等参数本来就在 request.args 上，视图函数可以直接复用
+    return list_and_search_apps()
 
 
 @app.route("/iot-study/appStore/apk", methods=["GET"])
@@ -1029,21 +1466,29 @@ def apk_details():
     app_id = request.args.get("appId")
     all_apps = load_apps()
 
-    found_app = next((app_data for app_data in all_apps if str(app_data.get("id")) == str(app_id)), None)
+    found_app = get_app_by_id(app_id)
 
     if not found_app:
         if all_apps: found_app = all_apps[0]
         else: return jsonify({"errNo": 1000, "errMsg": "App list is empty", "data": None})
 
-    mapped_app = map_app_fields(found_app)
-    apk_data = {"id": mapped_app["id"], "apkName": mapped_app["apkName"], "version": mapped_app["apkVersion"], "url": mapped_app["apkUrl"], "size": mapped_app["apkSize"], "md5": mapped_app["apkMd5"], "patchInfo": None}
+    # 🌟 详情响应按 (目录版本, 应用 id) 缓存序列化好的字节，目录没变就直接命中
+    key = ("apk", _APPS_CACHE["version"], found_app.get("id"))
+    body = _RESPONSE_CACHE.get(key)
+    if body is None:
+        # 载荷已在 _normalize_apps 里预组装 (_apkPayload)，这里直接取
+        apk_data = found_app.get("_apkPayload") or _build_apk_payload(found_app)
+        body = orjson.dumps({"errNo": 0, "errMsg": "succ", "cost": 11.45, "logId": g.now_ms_str, "requestId": g.now_ms_str, "data": apk_data})
+        if len(_RESPONSE_CACHE) >= _RESPONSE_CACHE_MAX:
+            _RESPONSE_CACHE.clear()
+        _RESPONSE_CACHE[key] = body
 
-    return jsonify({"errNo": 0, "errMsg": "succ", "cost": 11.45, "logId": f"{int(time.time() * 1000)}", "requestId": f"{int(time.time() * 1000)}", "data": apk_data})
+    return Response(body, mimetype="application/json")
 
 @app.route("/iot-study/appStore/system/apps", methods=["GET"])
-def system_apps_list(): return api_response_search(load_apps())
+def system_apps_list(): return _serialized_list_response(("all",), lambda all_apps: all_apps)
 @app.route("/iot-study/appStore/getAutoUpdateList", methods=["POST"])
-def auto_update_list(): return api_response_search(load_apps())
+def auto_update_list(): return _serialized_list_response(("all",), lambda all_apps: all_apps)
 
 @app.route("/iot-study/appStore/recommend/appList", methods=["POST"])
 def recommend_app_list(): return api_response_search([]) # 强制返回空列表
@@ -1066,12 +1511,26 @@ if __name__ == "__main__":
 
     # 修复启动时的应用上下文问题
     with app.app_context():
-        if not os.path.exists(app.config['UPLOAD_FOLDER']):
-            os.makedirs(app.config['UPLOAD_FOLDER'])
         # 确保配置文件存在并初始化
         if not os.path.exists(CONFIG_FILE):
             load_config()
         if not os.path.exists(SN_FILE):
             load_sn_config()
 
-    app.run(host="0.0.0.0", port=8080, debug=True)
+    # 🌟 docker stop / systemd 停服发的是 SIGTERM，不会触发 atexit；
+    # 显式接住，把脏数据同步落盘后再退出 (gunicorn 下有自己的优雅退出，走 atexit)
+    def _sigterm_flush(signum, frame):
+        flush_dirty_state()
+        raise SystemExit(0)
+    signal.signal(signal.SIGTERM, _sigterm_flush)
+
+    if os.environ.get("FLASK_DEV"):
+        # 开发模式：Werkzeug 调试服务器 (带 reloader/debugger，单进程，别上生产)
+        app.run(host="0.0.0.0", port=8080, debug=True)
+    else:
+        # 🌟 生产环境建议用 gunicorn 的单 worker 多线程模式：
+        #   gunicorn -w 1 -k gthread --threads 8 -b 0.0.0.0:8080 app:app
+        # 注意必须 -w 1：缓存和后台落盘都是进程内单写者设计，
+        # 多个 worker 各写各的 JSON 文件会互相覆盖
+        # 直接 python app.py 时退化为多线程、关掉 debug 的内置服务器
+        app.run(host="0.0.0.0", port=8080, debug=False, threaded=True)